@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""bench.py [-o results.json] [--baseline baseline.json] [--threshold 0.25]
+
+Measures runner's own overhead, independent of the work done by tasks, using
+synthetic task and config directories.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import sys
+import time
+import json
+import shlex
+import shutil
+import tempfile
+import platform
+import subprocess
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPDIR)
+
+import runner  # noqa
+from runner.lib.config import Config, TaskConfig  # noqa
+from runner.lib.graph import TaskGraph  # noqa
+
+import logging
+log = logging.getLogger(__name__)
+
+NOOP_TASK = "#!/bin/sh\nexit 0\n"
+
+
+def make_taskdir(dirname, num_tasks):
+    """Creates num_tasks no-op tasks in dirname, and a halt task"""
+    os.makedirs(dirname)
+    for i in range(num_tasks):
+        make_script(os.path.join(dirname, "%i-noop%i.sh" % (i, i)), NOOP_TASK)
+    make_script(os.path.join(dirname, "halt.sh"), NOOP_TASK)
+
+
+def make_script(filename, contents):
+    with open(filename, "w") as f:
+        f.write(contents)
+    os.chmod(filename, 0755)
+
+
+def make_configdir(dirname, num_fragments):
+    """Creates a runner.cfg in dirname that includes num_fragments files,
+    each with a per-task section and some [env] values. Returns the path to
+    runner.cfg
+    """
+    include_dir = os.path.join(dirname, "runner.d")
+    os.makedirs(include_dir)
+    for i in range(num_fragments):
+        with open(os.path.join(include_dir, "%04i.cfg" % i), "w") as f:
+            f.write("[noop%i]\nmax_time = 60\nmax_tries = 3\n" % i)
+            if i > 0:
+                f.write("depends_on = noop%i\n" % (i - 1))
+            f.write("\n[env]\nVAR%i = value%i\n" % (i, i))
+    filename = os.path.join(dirname, "runner.cfg")
+    with open(filename, "w") as f:
+        f.write("[runner]\nmax_time = 600\ninclude_dir = %s\n" % include_dir)
+    return filename
+
+
+def measure(func, repeat, number=1):
+    """Returns the median and fastest time per call of func, over `repeat`
+    rounds of `number` calls each
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(number):
+            func()
+        times.append((time.time() - start) / number)
+    times.sort()
+    return {
+        "seconds": times[len(times) // 2],
+        "min": times[0],
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def bench_run_task(ctx):
+    """Spawning and waiting on a single no-op task"""
+    task = os.path.join(ctx['taskdir'], "0-noop0.sh")
+    env = os.environ.copy()
+    return lambda: runner.run_task(task, env, max_time=60)
+
+
+def bench_task_hook(ctx):
+    """Building and running one pre-task hook command"""
+    env = os.environ.copy()
+    stats = dict(task="0-noop0.sh", try_num=1, max_retries=5, result="RUNNING")
+
+    def hook():
+        cmd = shlex.split("%s '%s'" % ("true", json.dumps(stats)))
+        runner.run_task(cmd, env, max_time=60)
+    return hook
+
+
+def bench_process_taskdir(ctx):
+    """A full iteration of the no-op task dir. Only comparable between runs
+    with the same --tasks
+    """
+    config = Config()
+    return lambda: runner.process_taskdir(config, ctx['taskdir'])
+
+
+def bench_process_taskdir_pipelined(ctx):
+    """As process_taskdir, with pipeline = yes"""
+    config = Config()
+    config.pipeline = True
+    return lambda: runner.process_taskdir(config, ctx['taskdir'])
+
+
+def bench_load_config(ctx):
+    """Loading a config with a large include_dir"""
+    return lambda: Config().load_config(ctx['config_file'])
+
+
+def bench_get_task_settings(ctx):
+    """Merging per-task settings for every task in the config"""
+    config = ctx['config']
+    names = ["noop%i" % i for i in range(ctx['num_fragments'])]
+
+    def merge():
+        for name in names:
+            config.get_task_settings(name)
+    return merge
+
+
+def bench_graph_sort(ctx):
+    """Building and sorting a dependency graph of chained tasks"""
+    pairs = [("noop%i" % i, ["noop%i" % (i - 1)] if i else [])
+             for i in range(ctx['num_graph_tasks'])]
+    return lambda: TaskGraph(map(TaskConfig.fromtuple, pairs)).sequential_ordering()
+
+
+def bench_get_startup(ctx):
+    """Running `runner -c runner.cfg -g section.option`, as tasks do via
+    RUNNER_CONFIG_CMD
+    """
+    cmd = [sys.executable, os.path.join(TOPDIR, "runner.py"),
+           "-c", ctx['config_file'], "-g", "runner.max_time"]
+    devnull = open(os.devnull, "w")
+    return lambda: subprocess.check_call(cmd, stdout=devnull)
+
+
+# name, setup function, number of calls per round
+BENCHMARKS = [
+    ("run_task", bench_run_task, 1),
+    ("task_hook", bench_task_hook, 1),
+    ("process_taskdir", bench_process_taskdir, 1),
+    ("process_taskdir_pipelined", bench_process_taskdir_pipelined, 1),
+    ("load_config", bench_load_config, 10),
+    ("get_task_settings", bench_get_task_settings, 10),
+    ("graph_sort", bench_graph_sort, 1),
+    ("get_startup", bench_get_startup, 1),
+]
+
+
+def run_benchmarks(ctx, names, repeat):
+    results = {}
+    for name, setup, number in BENCHMARKS:
+        if names and name not in names:
+            continue
+        log.info("running %s", name)
+        results[name] = measure(setup(ctx), repeat, number)
+        log.info("%s: %.6fs", name, results[name]['seconds'])
+    return results
+
+
+def find_regressions(results, baseline, default_threshold, thresholds):
+    """Returns a list of (name, baseline seconds, current seconds) for each
+    benchmark that is more than its threshold slower than the baseline
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        threshold = thresholds.get(name, default_threshold)
+        base = baseline[name]['seconds']
+        if result['seconds'] > base * (1 + threshold):
+            regressions.append((name, base, result['seconds']))
+    return regressions
+
+
+def parse_thresholds(values):
+    """
+    >>> sorted(parse_thresholds(['run_task=0.5', 'graph_sort=1']).items())
+    [('graph_sort', 1.0), ('run_task', 0.5)]
+    """
+    thresholds = {}
+    for v in values:
+        name, threshold = v.split("=", 1)
+        thresholds[name] = float(threshold)
+    return thresholds
+
+
+def make_argument_parser():
+    import argparse
+    parser = argparse.ArgumentParser(__doc__)
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fail if a benchmark is this fraction slower than the baseline "
+                             "(default %(default)s)")
+    parser.add_argument("--benchmark-threshold", dest="thresholds", action="append", default=[],
+                        metavar="NAME=FRACTION", help="override --threshold for one benchmark")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="rounds per benchmark")
+    parser.add_argument("--tasks", type=int, default=5, help="number of synthetic no-op tasks")
+    parser.add_argument("--fragments", type=int, default=200,
+                        help="number of include_dir config fragments")
+    parser.add_argument("--graph-tasks", type=int, default=200,
+                        help="number of tasks in the dependency graph")
+    parser.add_argument("names", nargs="*", metavar="benchmark",
+                        help="benchmarks to run (default all): %s" % ", ".join(b[0] for b in BENCHMARKS))
+    return parser
+
+
+def main():
+    parser = make_argument_parser()
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ctx = {
+            'taskdir': os.path.join(tmpdir, "tasks.d"),
+            'config_file': make_configdir(tmpdir, args.fragments),
+            'num_fragments': args.fragments,
+            'num_graph_tasks': args.graph_tasks,
+        }
+        make_taskdir(ctx['taskdir'], args.tasks)
+        ctx['config'] = Config()
+        ctx['config'].load_config(ctx['config_file'])
+        results = run_benchmarks(ctx, args.names, args.repeat)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    output = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        print json.dumps(output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['benchmarks']
+        regressions = find_regressions(results, baseline, args.threshold,
+                                       parse_thresholds(args.thresholds))
+        for name, base, current in regressions:
+            log.error("%s regressed: %.6fs -> %.6fs", name, base, current)
+        if regressions:
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,20 +7,81 @@ import sys
 import time
 import shlex
 import json
-import random
+import signal
+import threading
 import subprocess
 
 from lib.config import Config, TaskConfig
-from lib.graph import TaskGraph
-from lib.utils import list_directory
+from lib.graph import TaskGraph, TaskDoesNotExistError
+from lib.events import open_event_log
+from lib.triggers import OutputWatcher, make_triggers
+from lib.utils import list_directory, get_task_name, get_retry_sleep_time, sleep
 
 import logging
 log = logging.getLogger(__name__)
 
+# How many iterations to simulate if --times isn't given
+SIMULATE_TIMES = 1000
 
-def run_task(t, env, max_time):
+
+# Run by held tasks: waits for a byte on stdin before exec'ing its arguments
+# in place of itself. If stdin is closed without one, it exits without running
+# anything.
+HOLD_SCRIPT = """import os, sys
+if os.read(0, 1):
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.execvp(sys.argv[1], sys.argv[1:])
+"""
+
+
+def spawn_task(t, env, triggers=None, hold=False):
+    """Starts t, returning its Popen object and, if triggers were given, an
+    OutputWatcher for its output. If hold is True, t is spawned but doesn't
+    start running until release_task is called on it.
+    """
+    stdin = open(os.devnull, 'r')
+    if hold:
+        argv = [t] if isinstance(t, basestring) else list(t)
+        t = [sys.executable, '-c', HOLD_SCRIPT] + argv
+        stdin = subprocess.PIPE
+    if triggers:
+        # Watch the task's output for the trigger patterns. Python buffers
+        # its output when it isn't a terminal, so ask Python tasks not to, or
+        # their lines would only be seen when they exit.
+        env = dict(os.environ if env is None else env, PYTHONUNBUFFERED='1')
+        proc = subprocess.Popen(t, stdin=stdin, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, env=env)
+        return proc, OutputWatcher(proc.stdout, triggers)
+    return subprocess.Popen(t, stdin=stdin, env=env), None
+
+
+def release_task(proc):
+    """Lets a held task start running"""
+    try:
+        proc.stdin.write('x')
+        proc.stdin.close()
+    except IOError:
+        # It's already gone; wait_task will pick up why
+        pass
+
+
+def abort_task(proc):
+    """Stops a held task from ever running"""
+    proc.stdin.close()
+    proc.wait()
+
+
+def run_task(t, env, max_time, triggers=None, terminate_on_match=True, stats=None):
     start = time.time()
-    proc = subprocess.Popen(t, stdin=open(os.devnull, 'r'), env=env)
+    proc, watcher = spawn_task(t, env, triggers)
+    return wait_task(proc, watcher, start, max_time, terminate_on_match, stats)
+
+
+def wait_task(proc, watcher, start, max_time, terminate_on_match=True, stats=None):
+    """Waits for a task started at `start` to finish, returning its result.
+    If it exits, its exit code is stored in stats['exit_code'].
+    """
     while True:
         if proc.poll() is not None:
             break
@@ -28,16 +89,37 @@ def run_task(t, env, max_time):
         if max_time == 0:
             # if we've set to run forever, we can sleep for a lot longer
             # than 1 second.
-            time.sleep(20)
+            max_interval = 20
         elif time.time() - start > max_time:
             # Try killing it
             log.warn("exceeded max_time; killing")
             proc.terminate()
             return "RETRY"
         else:
-            time.sleep(1)
+            max_interval = 1
+        # Check often at first, so short tasks don't have to wait out a whole
+        # interval before the next can start; keeping it to a tenth of the
+        # time so far bounds how late we notice a task finishing
+        poll_interval = min(max_interval, max(0.005, (time.time() - start) / 10))
+
+        if watcher is None:
+            time.sleep(poll_interval)
+        elif watcher.wait(poll_interval):
+            if terminate_on_match:
+                log.info("output matched %s trigger; killing", watcher.result)
+                proc.terminate()
+            else:
+                log.info("output matched %s trigger; leaving task running", watcher.result)
+            return watcher.result
 
     rv = proc.wait()
+    if stats is not None:
+        stats['exit_code'] = rv
+    if watcher is not None:
+        # The end of the output may not have been checked yet
+        watcher.join(1)
+        if watcher.result is not None:
+            return watcher.result
     if rv == 0:
         return "OK"
     elif rv == 2:
@@ -48,25 +130,10 @@ def run_task(t, env, max_time):
         return "RETRY"
 
 
-def get_task_name(taskfile):
+def get_task_graph(config, dirname):
+    """Returns the TaskGraph of the tasks in dirname, connected by their
+    depends_on configuration. The halt task is never included.
     """
-    >>> get_task_name('3-buildbot.py')
-    'buildbot'
-    >>> get_task_name('buildbot.py')
-    'buildbot'
-    >>> get_task_name('buildbot')
-    'buildbot'
-    """
-    task_no_prefix = ''.join(taskfile.split('-')[1:])
-    taskname = task_no_prefix if task_no_prefix != '' else taskfile
-
-    task_no_suffix = ''.join(taskname.split('.')[0:-1])
-    taskname = task_no_suffix if task_no_suffix != '' else taskname
-
-    return taskname
-
-
-def process_taskdir(config, dirname):
     tasks = list_directory(dirname)
     # Filter out the halting task
     if config.halt_task in tasks:
@@ -81,75 +148,205 @@ def process_taskdir(config, dirname):
         else:
             taskconfigs.append(TaskConfig(t, []))
 
-    tg = TaskGraph(taskconfigs)  # construct the dependency graph
+    return TaskGraph(taskconfigs)  # construct the dependency graph
+
+
+def find_task(task_list, name):
+    """Returns the task in task_list with the given file name or task name
+
+    >>> find_task(['1-clobber.sh', '2-buildbot.py'], 'buildbot')
+    '2-buildbot.py'
+    >>> find_task(['1-clobber.sh', '2-buildbot.py'], '1-clobber.sh')
+    '1-clobber.sh'
+    """
+    for t in task_list:
+        if name in (t, get_task_name(t)):
+            return t
+    raise TaskDoesNotExistError("No such task: %s" % name)
+
+
+def get_task_list(config, dirname, only=None, from_task=None, with_deps=False):
+    """Returns the tasks in dirname, sorted so that each task comes after
+    the tasks it depends_on. The halt task is never included.
+
+    If `only` (a list of tasks) or `from_task` are given, just those tasks,
+    and the tasks which depend on from_task, are returned. If with_deps is
+    True, the tasks they depend on are included too.
+    """
+    tg = get_task_graph(config, dirname)
     task_list = tg.sequential_ordering()  # get a topologically sorted order
+    if not only and not from_task:
+        return task_list
+
+    selected = set(find_task(task_list, t) for t in only or [])
+    if from_task:
+        t = find_task(task_list, from_task)
+        selected.add(t)
+        selected.update(tg.descendants(t))
+    if with_deps:
+        for t in list(selected):
+            selected.update(tg.ancestors(t))
+    return [t for t in task_list if t in selected]
+
+
+def get_event_log(config):
+    """Returns the EventLog configured by event_log, or None"""
+    if not config.event_log:
+        return None
+    return open_event_log(config.event_log, config.event_log_max_bytes, config.event_log_backups)
+
+
+def get_halt_cmd(config, dirname):
+    halt_cmd = os.path.join(dirname, config.halt_task)
+    if config.interpreter:
+        # if a global task interpreter was set, it should apply
+        # here as well
+        halt_cmd = shlex.split("%s '%s'" % (config.interpreter, halt_cmd))
+    return halt_cmd
+
+
+def run_halt_task(config, dirname, max_time):
+    halt_env = config.get_task_env(get_task_name(config.halt_task))
+    halt_start = time.time()
+    halt_stats = {}
+    r = run_task(get_halt_cmd(config, dirname), halt_env, max_time=max_time, stats=halt_stats)
+
+    # Recorded like any other task, so the simulator can replay halts too
+    event_log = get_event_log(config)
+    if event_log:
+        event_log.write('task', task=config.halt_task, result=r, duration=round(time.time() - halt_start, 3),
+                        exit_code=halt_stats.get('exit_code'))
+    return r
+
+
+def prepare_task(config, dirname, t, try_num, env):
+    """Gets task t ready to run: works out its settings, command and
+    environment, and runs the pre-task hook with env. Returns (task_config,
+    task_stats, task_cmd, task_env)
+    """
+    # The global config, with any per-task overrides applied
+    task_config = config.get_task_settings(get_task_name(t))
+
+    # For consistent log info
+    task_stats = dict(task=t, try_num=try_num, max_retries=config.max_tries, result="RUNNING")
+    if config.task_hook:
+        task_hook_cmd = shlex.split("%s '%s'" % (config.task_hook, json.dumps(task_stats)))
+        log.debug("running pre-task hook: %s", " ".join(task_hook_cmd))
+        run_task(task_hook_cmd, env, max_time=task_config['max_time'])
+
+    task_cmd = os.path.join(dirname, t)
+    if task_config['interpreter']:
+        log.debug("%s: running with interpreter (%s)", t, task_config['interpreter'])
+        # using shlex affords the ability to pass arguments to the
+        # interpreter as well (i.e. bash -c)
+        task_cmd = shlex.split("%s '%s'" % (task_config['interpreter'], task_cmd))
+    task_env = config.get_task_env(get_task_name(t))
+    return task_config, task_stats, task_cmd, task_env
+
+
+def hold_task(config, dirname, t, try_num, env):
+    """Prepares task t and spawns it held, so it can be started the moment
+    the task before it finishes. This is done in a background thread, so the
+    task before can be waited on meanwhile. Returns a dict which
+    wait_held_task fills in with the prepare_task results and the held
+    process.
+    """
+    held = dict(task=t)
+
+    def prepare():
+        try:
+            prepared = prepare_task(config, dirname, t, try_num, env)
+            task_config, _, task_cmd, task_env = prepared
+            held['proc'], held['watcher'] = spawn_task(task_cmd, task_env, make_triggers(task_config),
+                                                       hold=True)
+            held['prepared'] = prepared
+        except Exception:
+            held['error'] = sys.exc_info()
+
+    held['thread'] = threading.Thread(target=prepare)
+    held['thread'].start()
+    return held
+
+
+def wait_held_task(held):
+    """Waits for hold_task to finish preparing a task, re-raising anything
+    that went wrong"""
+    held['thread'].join()
+    if 'error' in held:
+        raise held['error'][0], held['error'][1], held['error'][2]
 
-    log.debug("tasks: %s", task_list)
 
-    env = os.environ.copy()
-    new_env = config.get_env()
-    log.debug("Updating env with %s", new_env)
-    env.update(new_env)
+def process_taskdir(config, dirname, only=None, from_task=None, with_deps=False):
+    config.reload_if_requested()
+    task_list = get_task_list(config, dirname, only, from_task, with_deps)
+    pipeline = config.pipeline
 
-    default_config = {
-        "max_time": int(config.max_time),
-        "max_tries": int(config.max_tries),
-        "sleep_time": int(config.sleep_time),
-        "retry_jitter": int(config.retry_jitter),
-        "interpreter": config.interpreter,
-    }
+    log.debug("tasks: %s", task_list)
+
+    # The environment for hooks; tasks may add their own to it
+    env = config.get_task_env()
 
     start_task = 0  # For starting from the most recent task on a retry.
+    attempts = {}  # How many times each task has been run
     for try_num in range(1, config.max_tries + 1):
-        for task_count, t in enumerate(task_list[start_task:]):
-            # Here we add task_count to start_task to account for the fact that
-            # enumerate will start from zero on each loop through, so, if we
-            # start from a task other than zero (after a retry) the new offset
-            # will be this plus the number of tasks run after.
-            start_task = start_task + task_count
-            # Get the portion of a task's config that can override default_config
-            task_config = config.get_task_config(get_task_name(t))
-            task_config_dict = {}
-            # do it the long way for < 2.7.5 compatibility
-            for k, v in task_config.items():
-                if k in default_config:
-                    task_config_dict[k] = v
-            task_config = task_config_dict
-
-            # do the override
-            for k, v in default_config.items():
-                if k not in task_config:
-                    task_config[k] = v
-
-            # For consistent log info
-            task_stats = dict(task=t, try_num=try_num, max_retries=config.max_tries, result="RUNNING")
-            if config.task_hook:
-                task_hook_cmd = shlex.split("%s '%s'" % (config.task_hook, json.dumps(task_stats)))
-                log.debug("running pre-task hook: %s", " ".join(task_hook_cmd))
-                run_task(task_hook_cmd, env, max_time=task_config['max_time'])
-
-            log.debug("%s: starting (max time %is)", t, config.max_time)
-            task_cmd = os.path.join(dirname, t)
-            if task_config['interpreter']:
-                log.debug("%s: running with interpreter (%s)", t, task_config['interpreter'])
-                # using shlex affords the ability to pass arguments to the
-                # interpreter as well (i.e. bash -c)
-                task_cmd = shlex.split("%s '%s'" % (task_config['interpreter'], task_cmd))
-            r = run_task(task_cmd, env, max_time=task_config['max_time'])
+        first_task = start_task
+        held = None  # The next task, when pipelining
+        for task_count, t in enumerate(task_list[first_task:]):
+            # enumerate starts from zero on each loop through, so if we start
+            # from a task other than zero (after a retry) the offset of this
+            # task is the offset we started from plus the number of tasks run
+            # since.
+            start_task = first_task + task_count
+            if held is not None:
+                task_config, task_stats, task_cmd, task_env = held['prepared']
+            else:
+                # Changes to the config take effect between tasks
+                config.reload_if_requested()
+                task_config, task_stats, task_cmd, task_env = prepare_task(config, dirname, t, try_num, env)
+
+            log.debug("%s: starting (max time %is)", t, task_config['max_time'])
+            task_start = time.time()
+            if pipeline:
+                if held is not None:
+                    proc, watcher = held['proc'], held['watcher']
+                    release_task(proc)
+                else:
+                    proc, watcher = spawn_task(task_cmd, task_env, make_triggers(task_config))
+                # Get the next task ready while this one runs
+                held = None
+                if start_task + 1 < len(task_list):
+                    # Changes to the config take effect between tasks
+                    config.reload_if_requested()
+                    held = hold_task(config, dirname, task_list[start_task + 1], try_num, env)
+                r = wait_task(proc, watcher, task_start, task_config['max_time'],
+                              task_config['terminate_on_match'], stats=task_stats)
+            else:
+                r = run_task(task_cmd, task_env, max_time=task_config['max_time'],
+                             triggers=make_triggers(task_config),
+                             terminate_on_match=task_config['terminate_on_match'],
+                             stats=task_stats)
+            task_stats['result'] = r
+            task_stats['duration'] = round(time.time() - task_start, 3)
+            attempts[t] = attempts.get(t, 0) + 1
             log.debug("%s: %s", t, r)
 
+            event_log = get_event_log(config)
+            if event_log:
+                event_log.write('task', task=t, try_num=try_num, attempt=attempts[t], result=r,
+                                duration=task_stats['duration'], exit_code=task_stats.get('exit_code'))
+
+            if held is not None:
+                wait_held_task(held)
+                if r != "OK":
+                    log.debug("%s: not starting", held['task'])
+                    abort_task(held['proc'])
+                    held = None
+
             if config.task_hook:
-                task_stats['result'] = r
                 task_hook_cmd = shlex.split("%s '%s'" % (config.task_hook, json.dumps(task_stats)))
                 log.debug("running post-task hook: %s", " ".join(task_hook_cmd))
                 run_task(task_hook_cmd, env, max_time=config.max_time)
 
-            halt_cmd = os.path.join(dirname, config.halt_task)
-            if config.interpreter:
-                # if a global task interpreter was set, it should apply
-                # here as well
-                halt_cmd = shlex.split("%s '%s'" % (config.interpreter, halt_cmd))
-
             if r == "OK":
                 continue
             elif r == "RETRY":
@@ -157,20 +354,17 @@ def process_taskdir(config, dirname):
                 if try_num == task_config['max_tries']:
                     log.warn("maximum attempts reached")
                     log.info("halting")
-                    run_task(halt_cmd, env, max_time=task_config['max_time'])
+                    run_halt_task(config, dirname, task_config['max_time'])
                     return False
-                # Sleep and try again, sleep time is the lower bound within a
-                # random jitter. Note: the 1.14 was chosen at random
-                # and has no special meaning.
-                sleep_time = int((1.14**try_num) * random.randint(
-                    task_config['sleep_time'],
-                    task_config['sleep_time'] + task_config['retry_jitter']))
+                # Sleep and try again
+                sleep_time = get_retry_sleep_time(try_num, task_config['sleep_time'],
+                                                  task_config['retry_jitter'])
                 log.debug("sleeping for %i", sleep_time)
-                time.sleep(sleep_time)
+                sleep(sleep_time)
                 break
             elif r == "HALT":
                 log.info("halting")
-                run_task(halt_cmd, env, max_time=task_config['max_time'])
+                run_halt_task(config, dirname, task_config['max_time'])
                 return False
             elif r == "EXIT":
                 log.info("exiting")
@@ -203,6 +397,17 @@ def make_argument_parser():
     parser.add_argument("-c", "--config", dest="config_file")
     parser.add_argument("-g", "--get", help="get configuration value")
     parser.add_argument("-n", "--times", type=int, help="run this many times (default is forever)")
+    parser.add_argument("--simulate", dest="trace_file",
+                        help="simulate --times iterations (default %i) of taskdir using the task "
+                             "results recorded in TRACE_FILE, instead of running tasks" % SIMULATE_TIMES)
+    parser.add_argument("--only", action="append", metavar="TASK",
+                        help="only run this task; may be given more than once")
+    parser.add_argument("--from", dest="from_task", metavar="TASK",
+                        help="only run this task and the tasks which depend on it")
+    parser.add_argument("--with-deps", action="store_const", const=True,
+                        help="with --only or --from, also run the tasks they depend on")
+    parser.add_argument("--show-graph", action="store_const", const=True,
+                        help="print the tasks which would be run, grouped by dependency level, and exit")
     parser.add_argument("-H", "--halt-after", action="store_const", const=True,
                         help="Call the halt task after runner finishes (never called if -n is not set).")
     parser.add_argument("taskdir", help="task directory", nargs="?")
@@ -210,10 +415,11 @@ def make_argument_parser():
     return parser
 
 
-def runner(config, taskdir, times):
+def runner(config, taskdir, times, only=None, from_task=None, with_deps=False):
     """Runs tasks in the taskdir up to `times` number of times
 
-    times can be None to run forever
+    times can be None to run forever. only, from_task and with_deps select
+    which tasks to run, as for get_task_list
     """
     t = 0
     while True:
@@ -221,11 +427,70 @@ def runner(config, taskdir, times):
         if times and t > times:
             break
         log.info("iteration %i", t)
-        if not process_taskdir(config, taskdir):
+        start = time.time()
+        ok = process_taskdir(config, taskdir, only, from_task, with_deps)
+        event_log = get_event_log(config)
+        if event_log:
+            event_log.write('iteration', iteration=t, result="OK" if ok else "FAIL",
+                            duration=round(time.time() - start, 3))
+        if not ok:
             exit(1)
 
 
+def simulate(config, taskdir, trace_file, times, only=None, from_task=None, with_deps=False):
+    """Replays the task results in trace_file through `times` simulated
+    iterations of taskdir, and prints a summary of the iteration times
+    """
+    from lib.simulate import Simulator, load_traces, format_summary
+    with open(trace_file) as f:
+        traces = load_traces(f)
+    task_list = get_task_list(config, taskdir, only, from_task, with_deps)
+    simulator = Simulator(config, task_list, traces)
+    print format_summary(simulator.run(times))
+
+
+def show_graph(config, taskdir, only=None, from_task=None, with_deps=False):
+    """Prints the selected tasks in taskdir, one dependency level per line"""
+    selected = set(get_task_list(config, taskdir, only, from_task, with_deps))
+    for i, level in enumerate(get_task_graph(config, taskdir).levels()):
+        level = [t for t in level if t in selected]
+        if level:
+            print "%i: %s" % (i, " ".join(level))
+
+
+def make_stats_argument_parser():
+    import argparse
+    parser = argparse.ArgumentParser("runner stats [-c config] [event_log ...]")
+    parser.add_argument("-c", "--config", dest="config_file")
+    parser.add_argument("files", nargs="*", metavar="event_log",
+                        help="event logs to summarize (default is the configured event_log "
+                             "and its backups)")
+    return parser
+
+
+def stats_main(argv):
+    """Prints per-task summaries of the results in the event log"""
+    from lib.events import event_log_files, read_events, summarize_events, format_summaries
+    parser = make_stats_argument_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    files = args.files
+    if not files:
+        config = Config()
+        if args.config_file:
+            config.load_config(args.config_file)
+        if not config.event_log:
+            parser.error("no event logs given, and no event_log configured")
+        files = event_log_files(config.event_log, config.event_log_backups)
+    print format_summaries(summarize_events(read_events(files)))
+
+
 def main():
+    if sys.argv[1:2] == ['stats']:
+        stats_main(sys.argv[2:])
+        exit(0)
+
     parser = make_argument_parser()
     args = parser.parse_args()
     logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=args.loglevel)
@@ -253,8 +518,29 @@ def main():
         log.error("%s doesn't exist", args.taskdir)
         exit(1)
 
-    runner(config, args.taskdir, args.times)
+    selection = dict(only=args.only, from_task=args.from_task, with_deps=args.with_deps)
+    if args.only or args.from_task:
+        # Check the selected tasks exist now, rather than on the first
+        # iteration
+        try:
+            task_list = get_task_list(config, args.taskdir, **selection)
+        except TaskDoesNotExistError, e:
+            parser.error(str(e))
+        log.info("running only: %s", ", ".join(task_list))
+
+    if args.show_graph:
+        show_graph(config, args.taskdir, **selection)
+        exit(0)
+
+    if args.trace_file:
+        simulate(config, args.taskdir, args.trace_file, args.times or SIMULATE_TIMES, **selection)
+        exit(0)
+
+    if hasattr(signal, 'SIGHUP'):
+        # Pick up config changes without losing the current iteration
+        signal.signal(signal.SIGHUP, lambda signum, frame: config.request_reload())
+
+    runner(config, args.taskdir, args.times, **selection)
     if args.halt_after and config.halt_task:
-        halt_cmd = os.path.join(args.taskdir, config.halt_task)
-        log.info("finishing run with halt task: %s" % halt_cmd)
-        run_task(halt_cmd, os.environ, config.max_time)
+        log.info("finishing run with halt task: %s" % config.halt_task)
+        run_halt_task(config, args.taskdir, config.max_time)
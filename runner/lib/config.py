@@ -5,7 +5,7 @@
 import os
 import sys
 
-from ConfigParser import RawConfigParser
+from ConfigParser import RawConfigParser, Error as ConfigParserError
 from .utils import list_directory
 
 import logging
@@ -20,40 +20,165 @@ class Config(object):
     halt_task = "halt.sh"
     task_hook = None
     interpreter = None
+    success_pattern = None
+    fail_pattern = None
+    halt_pattern = None
+    terminate_on_match = True
+    pipeline = False
+    env_allowlist = None
+    event_log = None
+    event_log_max_bytes = 10 * 1024 * 1024
+    event_log_backups = 5
     filename = None
     options = None
 
+    # Options which can be overridden per task in the [taskname] section
+    task_int_options = ('max_time', 'max_tries', 'sleep_time', 'retry_jitter')
+    task_str_options = ('interpreter', 'success_pattern', 'fail_pattern', 'halt_pattern')
+    task_bool_options = ('terminate_on_match',)
+
+    # Options read from the [runner] section
+    runner_int_options = ('sleep_time', 'retry_jitter', 'max_tries', 'max_time',
+                          'event_log_max_bytes', 'event_log_backups')
+    runner_str_options = ('halt_task', 'task_hook', 'interpreter', 'event_log', 'env_allowlist')
+    runner_bool_options = ('pipeline',)
+
+    reload_requested = False
+
+    def __init__(self):
+        # filename -> ((mtime, size), RawConfigParser) for each file loaded
+        self._files = {}
+        # taskname -> environment, as built by get_task_env
+        self._envs = {}
+
     def load_config(self, filename):
         self.filename = filename
-        self.options = RawConfigParser()
+        self.options = None
+        self._files = {}
+        self.reload()
+
+    def request_reload(self):
+        """Asks for the config to be reloaded the next time
+        reload_if_requested is called. Safe to call from a signal handler.
+        """
+        self.reload_requested = True
+
+    def reload_if_requested(self):
+        if self.reload_requested:
+            self.reload_requested = False
+            log.info("reloading %s", self.filename)
+            try:
+                self.reload()
+            except (ValueError, ConfigParserError), e:
+                log.error("Couldn't reload %s, keeping the current config: %s", self.filename, e)
+
+    def reload(self):
+        """Reloads the config file and any files in its include_dir. Only
+        files which have changed since they were last loaded are parsed
+        again. Returns True if the config changed.
+        """
+        if self.filename is None:
+            return False
+        old_files = self._files
+        files = {}
+        main = self._read_file(self.filename, old_files, files)
+        if main is None:
+            # If we've loaded it before, keep running with what we had
+            log.warn("Couldn't load %s", self.filename)
+            return False
+
+        filenames = [self.filename]
+        if main.has_option('runner', 'include_dir'):
+            config_dir = main.get('runner', 'include_dir')
+            try:
+                configs = sorted(list_directory(config_dir))
+            except OSError:
+                log.warn("Couldn't load %s", config_dir)
+                configs = []
+            for c in configs:
+                f = os.path.join(config_dir, c)
+                if self._read_file(f, old_files, files) is None:
+                    log.warn("Couldn't load %s", f)
+                filenames.append(f)
+        if self.options is not None and files == old_files:
+            return False
+
+        # Later files override earlier ones
+        options = RawConfigParser()
         # The default optionxform converts option names to lower case. We want
         # to preserve case, so change the transform function to just return the
         # str value
-        self.options.optionxform = str
-        if not self.options.read([filename]):
-            log.warn("Couldn't load %s", filename)
-            self.options = None
-            return
-        if self.options.has_option('runner', 'include_dir'):
-            # reload the object including files in config.d
-            config_dir = self.options.get('runner', 'include_dir')
-            configs = [os.path.join(config_dir, c) for c in list_directory(config_dir)]
-            if not self.options.read([filename] + configs):
-                log.warn("Couldn't load %s", config_dir)
-                return
-
-        if self.options.has_option('runner', 'sleep_time'):
-            self.sleep_time = self.options.getint('runner', 'sleep_time')
-        if self.options.has_option('runner', 'max_tries'):
-            self.max_tries = self.options.getint('runner', 'max_tries')
-        if self.options.has_option('runner', 'max_time'):
-            self.max_time = self.options.getint('runner', 'max_time')
-        if self.options.has_option('runner', 'halt_task'):
-            self.halt_task = self.options.get('runner', 'halt_task')
-        if self.options.has_option('runner', 'task_hook'):
-            self.task_hook = self.options.get('runner', 'task_hook')
-        if self.options.has_option('runner', 'interpreter'):
-            self.interpreter = self.options.get('runner', 'interpreter')
+        options.optionxform = str
+        for f in filenames:
+            if f in files:
+                self._merge(options, files[f][1])
+
+        # Only start using the new config once it's all been read
+        self._apply(options)
+        self._files = files
+        return True
+
+    @staticmethod
+    def _read_file(filename, old_files, files):
+        """Returns a RawConfigParser for filename, or None if it can't be
+        read. If filename is unchanged since it was loaded into old_files, the
+        parser from then is returned rather than parsing it again. The result
+        is stored in files.
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        signature = (st.st_mtime, st.st_size)
+        if filename in old_files and old_files[filename][0] == signature:
+            parser = old_files[filename][1]
+        else:
+            parser = RawConfigParser()
+            parser.optionxform = str
+            if not parser.read([filename]):
+                return None
+        files[filename] = (signature, parser)
+        return parser
+
+    @staticmethod
+    def _merge(options, parser):
+        """Copies all the sections and options from parser into options"""
+        for option, value in parser.defaults().items():
+            options.set('DEFAULT', option, value)
+        for section in parser.sections():
+            if not options.has_section(section):
+                options.add_section(section)
+            # Only what the file sets in the section itself; items() would also
+            # include its [DEFAULT]s, which were merged above
+            for option, value in parser._sections[section].items():
+                if option != '__name__':
+                    options.set(section, option, value)
+
+    def _apply(self, options):
+        """Switches to using options, updating the [runner] settings from
+        them. Settings which are no longer set go back to their defaults.
+        """
+        settings = {}
+        for k in self.runner_int_options:
+            if options.has_option('runner', k):
+                settings[k] = options.getint('runner', k)
+            else:
+                settings[k] = getattr(type(self), k)
+        for k in self.runner_str_options:
+            if options.has_option('runner', k):
+                settings[k] = options.get('runner', k)
+            else:
+                settings[k] = getattr(type(self), k)
+        for k in self.runner_bool_options:
+            if options.has_option('runner', k):
+                settings[k] = options.getboolean('runner', k)
+            else:
+                settings[k] = getattr(type(self), k)
+
+        self.options = options
+        for k, v in settings.items():
+            setattr(self, k, v)
+        self._envs = {}
 
     def get(self, section, option):
         if self.options and self.options.has_option(section, option):
@@ -73,6 +198,37 @@ class Config(object):
             )
         return retval
 
+    def get_task_env(self, taskname=None):
+        """Returns the environment to run taskname with: our own environment
+        (or just the variables in env_allowlist, if set), the [env] section,
+        and the [env:taskname] section. If taskname is None, the
+        [env:taskname] part is left out.
+
+        The result is reused until the config is reloaded, so must not be
+        modified.
+        """
+        if taskname in self._envs:
+            return self._envs[taskname]
+
+        if taskname is None:
+            if self.env_allowlist:
+                allowed = [v.strip() for v in self.env_allowlist.split(',')]
+                env = dict((k, os.environ[k]) for k in allowed if k in os.environ)
+            else:
+                env = os.environ.copy()
+            new_env = self.get_env()
+            log.debug("Updating env with %s", new_env)
+            env.update(new_env)
+        else:
+            env = self.get_task_env()
+            section = 'env:%s' % taskname
+            if self.options and self.options.has_section(section):
+                env = env.copy()
+                for option, value in self.options.items(section):
+                    env[str(option)] = str(value)
+        self._envs[taskname] = env
+        return env
+
     def get_task_config(self, taskname):
         """Returns a dict of the config options for [taskname]
         or an empty dict otherwise
@@ -81,6 +237,24 @@ class Config(object):
             return dict(self.options.items(taskname))
         return {}
 
+    def get_task_settings(self, taskname):
+        """Returns a dict of the runner settings for [taskname]: the global
+        values, overridden by any set in the task's own section
+        """
+        settings = {}
+        for k in self.task_int_options:
+            settings[k] = int(getattr(self, k))
+        for k in self.task_str_options + self.task_bool_options:
+            settings[k] = getattr(self, k)
+        for k, v in self.get_task_config(taskname).items():
+            if k in self.task_int_options:
+                settings[k] = int(v)
+            elif k in self.task_str_options:
+                settings[k] = v
+            elif k in self.task_bool_options:
+                settings[k] = self.options.getboolean(taskname, k)
+        return settings
+
 
 class TaskConfig(object):
     def __init__(self, name, dependencies):
@@ -0,0 +1,153 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Structured log of task results, one compact JSON record per line, and
+summaries of it.
+"""
+
+import os
+import json
+import math
+import time
+import logging
+from logging.handlers import RotatingFileHandler
+
+log = logging.getLogger(__name__)
+
+# Open event logs, so handlers are reused across iterations
+_event_logs = {}
+
+
+class EventLog(object):
+    """Appends records to filename, rotating it once it's bigger than
+    max_bytes and keeping `backups` old copies
+    """
+    def __init__(self, filename, max_bytes=0, backups=0):
+        self.filename = filename
+        self.handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backups)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def write(self, event, **fields):
+        fields['event'] = event
+        fields.setdefault('time', round(time.time(), 3))
+        record = logging.makeLogRecord(dict(msg=json.dumps(fields, separators=(',', ':'), sort_keys=True)))
+        self.handler.handle(record)
+
+
+def open_event_log(filename, max_bytes=0, backups=0):
+    """Returns the EventLog for filename, opening it if needed"""
+    key = (filename, max_bytes, backups)
+    if key not in _event_logs:
+        _event_logs[key] = EventLog(filename, max_bytes, backups)
+    return _event_logs[key]
+
+
+def event_log_files(filename, backups):
+    """Returns the files an event log and its rotated copies are in, oldest
+    first"""
+    files = ["%s.%i" % (filename, i) for i in range(backups, 0, -1)] + [filename]
+    return [f for f in files if os.path.exists(f)]
+
+
+def read_events(files):
+    """Yields the records in files, one at a time"""
+    for filename in files:
+        with open(filename) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    log.debug("skipping malformed event: %s", line)
+
+
+class Histogram(object):
+    """Approximate distribution of durations, in logarithmic buckets which are
+    each 5% wide, so memory use doesn't grow with the number of values
+
+    >>> h = Histogram()
+    >>> for v in range(1, 101):
+    ...     h.add(v)
+    >>> 48 < h.percentile(50) < 53
+    True
+    >>> 90 < h.percentile(95) < 100
+    True
+    """
+    base = 1.05
+    # Anything shorter is counted as this
+    min_value = 0.001
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+
+    def add(self, value):
+        bucket = int(math.floor(math.log(max(value, self.min_value), self.base)))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = int(math.ceil(p / 100.0 * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                # the middle of the bucket
+                return self.base ** (bucket + 0.5)
+
+
+class TaskSummary(object):
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.retries = 0
+        self.results = {}
+        self.durations = Histogram()
+
+    def add(self, event):
+        self.runs += 1
+        result = event.get('result')
+        self.results[result] = self.results.get(result, 0) + 1
+        if result != "OK":
+            self.failures += 1
+        # try_num counts the iteration's tries, which may have started before
+        # this task ever ran; attempt is this task's own count
+        if event.get('attempt', 1) > 1:
+            self.retries += 1
+        if event.get('duration') is not None:
+            self.durations.add(event['duration'])
+
+
+def summarize_events(events):
+    """Returns a dict of task name to TaskSummary for the task events. The
+    iteration events are summarized under None.
+    """
+    summaries = {}
+    for event in events:
+        if event.get('event') == 'iteration':
+            key = None
+        elif event.get('event') == 'task':
+            key = event.get('task')
+        else:
+            continue
+        if key not in summaries:
+            summaries[key] = TaskSummary()
+        summaries[key].add(event)
+    return summaries
+
+
+def format_summaries(summaries):
+    def fmt_time(t):
+        return "-" if t is None else "%.2fs" % t
+
+    lines = ["%-30s %8s %7s %8s %9s %9s" % ("task", "runs", "fail%", "retries", "p50", "p95")]
+    for key in sorted(k for k in summaries if k is not None) + [None]:
+        if key not in summaries:
+            continue
+        s = summaries[key]
+        lines.append("%-30s %8i %6.1f%% %8i %9s %9s" % (
+            "(iterations)" if key is None else key, s.runs, 100.0 * s.failures / s.runs,
+            s.retries, fmt_time(s.durations.percentile(50)), fmt_time(s.durations.percentile(95))))
+    return "\n".join(lines)
@@ -14,6 +14,10 @@ class DependencyDoesNotExistError(Exception):
     pass
 
 
+class TaskDoesNotExistError(Exception):
+    pass
+
+
 class TaskGraph(object):
     def __init__(self, taskconfigs):
         self._nodes = {}
@@ -66,6 +70,54 @@ class TaskGraph(object):
         to_ret.reverse()  # because we point TO our dependents
         return to_ret
 
+    def ancestors(self, name):
+        """Returns the names of the tasks which name depends on, directly or
+        indirectly"""
+        return self._reachable(name, lambda node: node.dependencies)
+
+    def descendants(self, name):
+        """Returns the names of the tasks which depend on name, directly or
+        indirectly"""
+        dependents = dict((n, set()) for n in self._nodes.values())
+        for node in self._nodes.values():
+            for dep in node.dependencies:
+                dependents[dep].add(node)
+        return self._reachable(name, lambda node: dependents[node])
+
+    def _reachable(self, name, edges):
+        """Returns the names of the nodes reachable from name by following
+        edges(node)"""
+        if name not in self._nodes:
+            raise TaskDoesNotExistError("No such task: %s" % name)
+        seen = set()
+        stack = [self._nodes[name]]
+        while stack:
+            for m in edges(stack.pop()):
+                if m.name not in seen:
+                    seen.add(m.name)
+                    stack.append(m)
+        return seen
+
+    def levels(self):
+        """Groups the tasks into dependency levels. The first level is the
+        tasks with no dependencies, and each level after it is the tasks whose
+        dependencies are all in earlier levels. Tasks in the same level don't
+        depend on each other.
+        """
+        remaining = dict((n.name, set(d.name for d in n.dependencies))
+                         for n in self._nodes.values())
+        levels = []
+        while remaining:
+            level = sorted(n for n, deps in remaining.items() if not deps)
+            if not level:
+                raise CycleError("Graph of task dependencies has cycles")
+            for n in level:
+                del remaining[n]
+            for deps in remaining.values():
+                deps.difference_update(level)
+            levels.append(level)
+        return levels
+
     @classmethod
     def _start_nodes(cls, graph):
         """Returns the nodes in the graph with no dependencies"""
@@ -0,0 +1,159 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Offline replay of recorded task results through the runner's retry and
+halt logic, to estimate how long iterations take under a given config.
+"""
+
+import json
+import math
+import random
+
+from .utils import get_task_name, get_retry_sleep_time
+
+import logging
+log = logging.getLogger(__name__)
+
+RESULTS = ("OK", "RETRY", "HALT", "EXIT")
+
+
+def load_traces(lines):
+    """Returns a dict mapping task to the {try_num: [(duration, result)]}
+    samples recorded for it. The samples for all tries are under the None
+    key.
+
+    lines is an iterable of JSON task stats, as passed to the post-task hook
+    or written to the event log. Records without a final result or duration
+    are skipped.
+    """
+    traces = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            log.warn("skipping malformed trace record: %s", line)
+            continue
+        if record.get('event', 'task') != 'task':
+            continue
+        if record.get('result') not in RESULTS or record.get('duration') is None:
+            continue
+        sample = (float(record['duration']), str(record['result']))
+        task_traces = traces.setdefault(str(record['task']), {None: []})
+        task_traces[None].append(sample)
+        if record.get('try_num') is not None:
+            task_traces.setdefault(record['try_num'], []).append(sample)
+    return traces
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 95)
+    4
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, rank)]
+
+
+class Simulator(object):
+    """Simulates calls to process_taskdir, replacing task runs with results
+    sampled from recorded traces and sleeps with simulated time
+    """
+    def __init__(self, config, task_list, traces, rand=None):
+        self.config = config
+        self.task_list = task_list
+        self.traces = traces
+        self.rand = rand or random.Random()
+        # Looking up task settings is the expensive part of a simulated
+        # iteration, and they can't change between iterations
+        self._settings = dict((t, config.get_task_settings(get_task_name(t)))
+                              for t in task_list)
+
+    def _sample(self, task, try_num):
+        """Returns a (duration, result) pair for a task, preferring samples
+        recorded at the same try_num. Tasks with no samples take no time and
+        always succeed.
+        """
+        task_traces = self.traces.get(task)
+        if not task_traces:
+            return 0.0, "OK"
+        return self.rand.choice(task_traces.get(try_num) or task_traces[None])
+
+    def _halt_duration(self):
+        duration, _ = self._sample(self.config.halt_task, None)
+        return duration
+
+    def run_iteration(self):
+        """Returns (elapsed, outcome) for a single simulated iteration.
+        outcome is "OK" if all tasks completed, "HALT" or "EXIT" if the
+        iteration stopped early, or "RETRY" if it ran out of tries without
+        halting.
+        """
+        elapsed = 0.0
+        start_task = 0
+        for try_num in range(1, self.config.max_tries + 1):
+            first_task = start_task
+            for task_count, t in enumerate(self.task_list[first_task:]):
+                start_task = first_task + task_count
+                task_config = self._settings[t]
+
+                duration, r = self._sample(t, try_num)
+                if task_config['max_time'] and duration > task_config['max_time']:
+                    # The recorded run would be killed under this config
+                    duration, r = task_config['max_time'], "RETRY"
+                elapsed += duration
+
+                if r == "OK":
+                    continue
+                elif r == "RETRY":
+                    if try_num == task_config['max_tries']:
+                        return elapsed + self._halt_duration(), "HALT"
+                    elapsed += get_retry_sleep_time(try_num, task_config['sleep_time'],
+                                                    task_config['retry_jitter'], self.rand)
+                    break
+                elif r == "HALT":
+                    return elapsed + self._halt_duration(), "HALT"
+                elif r == "EXIT":
+                    return elapsed, "EXIT"
+            else:
+                return elapsed, "OK"
+        return elapsed, "RETRY"
+
+    def run(self, iterations):
+        """Simulates the given number of iterations, returning a summary
+        dict of the outcomes and iteration times
+        """
+        times = []
+        outcomes = dict((r, 0) for r in RESULTS)
+        for _ in xrange(iterations):
+            elapsed, outcome = self.run_iteration()
+            times.append(elapsed)
+            outcomes[outcome] += 1
+        times.sort()
+        return {
+            "iterations": iterations,
+            "outcomes": outcomes,
+            "mean": sum(times) / len(times) if times else None,
+            "p50": percentile(times, 50),
+            "p95": percentile(times, 95),
+            "max": times[-1] if times else None,
+        }
+
+
+def format_summary(summary):
+    lines = ["iterations: %i" % summary['iterations']]
+    for r in RESULTS:
+        count = summary['outcomes'][r]
+        lines.append("%s: %i (%.1f%%)" % (r, count, 100.0 * count / max(summary['iterations'], 1)))
+    for k in ("mean", "p50", "p95", "max"):
+        if summary[k] is not None:
+            lines.append("%s: %.1fs" % (k, summary[k]))
+    return "\n".join(lines)
@@ -0,0 +1,81 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import re
+import sys
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+# Task settings holding output patterns, and the result a match maps to.
+# If a line matches more than one, the first one listed wins.
+TRIGGER_OPTIONS = (
+    ('halt_pattern', 'HALT'),
+    ('fail_pattern', 'RETRY'),
+    ('success_pattern', 'OK'),
+)
+
+
+def make_triggers(task_config):
+    """Returns a list of (compiled regex, result) for the patterns set in
+    task_config, or None if there are none
+    """
+    triggers = []
+    for option, result in TRIGGER_OPTIONS:
+        pattern = task_config.get(option)
+        if not pattern:
+            continue
+        try:
+            triggers.append((re.compile(pattern), result))
+        except re.error, e:
+            log.error("ignoring invalid %s %r: %s", option, pattern, e)
+    return triggers or None
+
+
+class OutputWatcher(object):
+    """Copies lines from a task's output stream to our stdout, and checks each
+    one against the task's triggers. The result of the first match is stored
+    in `result`, and `matched` is set.
+    """
+    def __init__(self, stream, triggers, output=sys.stdout):
+        self.stream = stream
+        self.triggers = triggers
+        self.output = output
+        self.result = None
+        self.matched = threading.Event()
+        self._thread = threading.Thread(target=self._watch)
+        # Tasks left running after a match keep their output flowing through
+        # us; that shouldn't stop runner from exiting
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _watch(self):
+        # readline rather than iterating, to avoid file read-ahead delaying
+        # matches
+        for line in iter(self.stream.readline, ''):
+            self.output.write(line)
+            self.output.flush()
+            if self.result is None:
+                self._check(line)
+        self.stream.close()
+
+    def _check(self, line):
+        for regex, result in self.triggers:
+            if regex.search(line):
+                log.debug("output matched %s: %s", regex.pattern, line.rstrip())
+                self.result = result
+                self.matched.set()
+                return
+
+    def wait(self, timeout):
+        """Waits up to timeout seconds for a match. Returns True if there has
+        been one"""
+        self.matched.wait(timeout)
+        return self.matched.is_set()
+
+    def join(self, timeout):
+        """Waits up to timeout seconds for the rest of the output to be
+        read"""
+        self._thread.join(timeout)
@@ -3,6 +3,8 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import os
+import time
+import random
 
 
 def list_directory(dirname):
@@ -10,3 +12,38 @@ def list_directory(dirname):
     files = os.listdir(dirname)
     # Filter out files with leading .
     return [f for f in files if f[0] != '.']
+
+
+def get_task_name(taskfile):
+    """
+    >>> get_task_name('3-buildbot.py')
+    'buildbot'
+    >>> get_task_name('buildbot.py')
+    'buildbot'
+    >>> get_task_name('buildbot')
+    'buildbot'
+    """
+    task_no_prefix = ''.join(taskfile.split('-')[1:])
+    taskname = task_no_prefix if task_no_prefix != '' else taskfile
+
+    task_no_suffix = ''.join(taskname.split('.')[0:-1])
+    taskname = task_no_suffix if task_no_suffix != '' else taskname
+
+    return taskname
+
+
+def get_retry_sleep_time(try_num, sleep_time, retry_jitter, rand=random):
+    # Sleep time is the lower bound within a random jitter, growing with
+    # each try. Note: the 1.14 was chosen at random and has no special
+    # meaning.
+    return int((1.14**try_num) * rand.randint(sleep_time, sleep_time + retry_jitter))
+
+
+def sleep(seconds):
+    # time.sleep can return early when a signal (e.g. SIGHUP, for reloading
+    # the config) is handled, so keep sleeping until the time is up
+    deadline = time.time() + seconds
+    remaining = seconds
+    while remaining > 0:
+        time.sleep(remaining)
+        remaining = deadline - time.time()
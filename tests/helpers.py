@@ -0,0 +1,24 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Task directories for the tests"""
+
+import os
+
+
+def make_script(filename, contents):
+    with open(filename, 'w') as f:
+        f.write(contents)
+    os.chmod(filename, 0755)
+
+
+def make_taskdir(dirname, exit_codes, logfile=None):
+    """Creates tasks in dirname which exit with the given codes, and a halt
+    task which exits with 0. If logfile is given, each task first logs its
+    name to it.
+    """
+    os.makedirs(dirname)
+    for name, rv in exit_codes + [('halt.sh', 0)]:
+        log_cmd = "echo %s >> %s\n" % (name, logfile) if logfile else ""
+        make_script(os.path.join(dirname, name), "#!/bin/sh\n%sexit %i\n" % (log_cmd, rv))
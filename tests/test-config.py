@@ -0,0 +1,183 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import shutil
+import tempfile
+
+from nose import with_setup
+
+from runner.lib.config import Config
+
+configdir = None
+
+
+def make_configdir():
+    global configdir
+    configdir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(configdir, 'runner.d'))
+
+
+def remove_configdir():
+    shutil.rmtree(configdir)
+
+
+def write_config(name, contents, mtime=None):
+    filename = os.path.join(configdir, name)
+    with open(filename, 'w') as f:
+        f.write(contents)
+    if mtime is not None:
+        # Make sure a rewritten file looks changed, even if it's the same
+        # size and rewritten within the mtime resolution
+        os.utime(filename, (mtime, mtime))
+    return filename
+
+
+def make_config():
+    filename = write_config('runner.cfg', '[runner]\nmax_tries = 3\nmax_time = 60\n'
+                            'include_dir = %s\n' % os.path.join(configdir, 'runner.d'))
+    write_config('runner.d/1-env.cfg', '[env]\nFOO = 1\n')
+    write_config('runner.d/2-buildbot.cfg', '[buildbot]\nmax_time = 30\n\n[runner]\nmax_tries = 4\n')
+    config = Config()
+    config.load_config(filename)
+    return config
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_include_dir():
+    config = make_config()
+    # included files override the main file
+    assert config.max_tries == 4
+    assert config.max_time == 60
+    assert config.get('env', 'FOO') == '1'
+    assert config.get_task_settings('buildbot')['max_time'] == 30
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_include_dir_overrides_with_default_value():
+    write_config('runner.cfg', '[runner]\ninclude_dir = %s\n\n[foo]\nx = 5\n'
+                 % os.path.join(configdir, 'runner.d'))
+    # the [foo] value is set explicitly, even though it's the same as the
+    # file's [DEFAULT]
+    write_config('runner.d/1-foo.cfg', '[DEFAULT]\nx = 1\n\n[foo]\nx = 1\n')
+    config = Config()
+    config.load_config(os.path.join(configdir, 'runner.cfg'))
+    assert config.get('foo', 'x') == '1'
+    assert config.get('runner', 'x') == '1'
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_reload_unchanged():
+    config = make_config()
+    options = config.options
+    assert not config.reload()
+    assert config.options is options
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_reload_changed_fragment():
+    config = make_config()
+    env_parser = config._files[os.path.join(configdir, 'runner.d', '1-env.cfg')][1]
+
+    write_config('runner.d/2-buildbot.cfg', '[buildbot]\nmax_time = 45\n', mtime=1)
+    write_config('runner.d/3-new.cfg', '[env]\nBAR = 2\n')
+    assert config.reload()
+
+    # unchanged files aren't parsed again
+    assert config._files[os.path.join(configdir, 'runner.d', '1-env.cfg')][1] is env_parser
+    assert config.get_task_settings('buildbot')['max_time'] == 45
+    assert config.get('env', 'BAR') == '2'
+    # settings that have been removed go back to what the main file says
+    assert config.max_tries == 3
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_reload_removed_setting():
+    config = make_config()
+    write_config('runner.cfg', '[runner]\ninclude_dir = %s\n' % os.path.join(configdir, 'runner.d'),
+                 mtime=1)
+    os.remove(os.path.join(configdir, 'runner.d', '2-buildbot.cfg'))
+    assert config.reload()
+    assert config.max_time == Config.max_time
+    assert config.max_tries == Config.max_tries
+    assert config.get_task_config('buildbot') == {}
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_reload_if_requested():
+    config = make_config()
+    write_config('runner.d/1-env.cfg', '[env]\nFOO = 2\n', mtime=1)
+    config.reload_if_requested()
+    assert config.get('env', 'FOO') == '1'
+
+    config.request_reload()
+    config.reload_if_requested()
+    assert config.get('env', 'FOO') == '2'
+    assert not config.reload_requested
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_reload_bad_value_keeps_config():
+    config = make_config()
+    write_config('runner.d/2-buildbot.cfg', '[runner]\nmax_tries = lots\n', mtime=1)
+    config.request_reload()
+    config.reload_if_requested()
+    assert config.max_tries == 4
+    assert config.get_task_settings('buildbot')['max_time'] == 30
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_reload_malformed_file_keeps_config():
+    config = make_config()
+    write_config('runner.d/a.cfg', 'garbage line\n')
+    config.request_reload()
+    config.reload_if_requested()
+    assert config.max_tries == 4
+    assert config.get('env', 'FOO') == '1'
+
+    write_config('runner.d/a.cfg', '[env]\nnot an option\n', mtime=1)
+    config.request_reload()
+    config.reload_if_requested()
+    assert config.max_tries == 4
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_task_env():
+    config = make_config()
+    write_config('runner.d/3-buildbot-env.cfg', '[env:buildbot]\nFOO = 3\nBAR = 4\n')
+    config.reload()
+
+    env = config.get_task_env()
+    assert env['FOO'] == '1'
+    assert 'BAR' not in env
+    assert 'RUNNER_CONFIG_CMD' in env
+    assert env['PATH'] == os.environ['PATH']
+
+    buildbot_env = config.get_task_env('buildbot')
+    assert buildbot_env['FOO'] == '3'
+    assert buildbot_env['BAR'] == '4'
+    assert buildbot_env['PATH'] == os.environ['PATH']
+    # tasks without their own env share the common one
+    assert config.get_task_env('clobber') is env
+    assert config.get_task_env() is env
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_task_env_reload():
+    config = make_config()
+    assert config.get_task_env()['FOO'] == '1'
+    write_config('runner.d/1-env.cfg', '[env]\nFOO = 2\n', mtime=1)
+    config.reload()
+    assert config.get_task_env()['FOO'] == '2'
+
+
+@with_setup(make_configdir, remove_configdir)
+def test_env_allowlist():
+    config = make_config()
+    write_config('runner.d/3-allowlist.cfg', '[runner]\nenv_allowlist = PATH, NOT_SET_ANYWHERE\n')
+    config.reload()
+
+    env = config.get_task_env()
+    assert sorted(env) == ['FOO', 'PATH', 'RUNNER_CONFIG_CMD']
+    assert env['PATH'] == os.environ['PATH']
@@ -0,0 +1,88 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import shutil
+import tempfile
+
+from nose import with_setup
+
+import runner
+
+from runner.lib.config import Config
+from runner.lib.events import EventLog, event_log_files, read_events, summarize_events
+from runner.lib.simulate import load_traces
+
+from helpers import make_taskdir
+
+tmpdir = None
+
+
+def make_tmpdir():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+
+def remove_tmpdir():
+    shutil.rmtree(tmpdir)
+
+
+@with_setup(make_tmpdir, remove_tmpdir)
+def test_event_log_rotation():
+    filename = os.path.join(tmpdir, 'events.log')
+    event_log = EventLog(filename, max_bytes=200, backups=2)
+    for i in range(20):
+        event_log.write('task', task='t%i' % i, try_num=1, result='OK', duration=i)
+
+    files = event_log_files(filename, 2)
+    assert files == [filename + '.2', filename + '.1', filename]
+    events = list(read_events(files))
+    # the oldest have been rotated away, the rest are in order
+    tasks = [e['task'] for e in events]
+    assert tasks == ['t%i' % i for i in range(20 - len(tasks), 20)]
+    assert all(e['event'] == 'task' and 'time' in e for e in events)
+
+
+def test_summarize_events():
+    events = [dict(event='task', task='a', try_num=1, attempt=1, result='RETRY', duration=10),
+              dict(event='task', task='a', try_num=2, attempt=2, result='OK', duration=1),
+              # b first ran on the iteration's second try; that isn't a retry
+              dict(event='task', task='b', try_num=2, attempt=1, result='OK', duration=2),
+              dict(event='iteration', iteration=1, result='OK', duration=13),
+              dict(event='something new')]
+    summaries = summarize_events(events)
+    assert sorted(summaries) == [None, 'a', 'b']
+    assert summaries['a'].runs == 2
+    assert summaries['a'].failures == 1
+    assert summaries['a'].retries == 1
+    assert summaries['b'].retries == 0
+    assert 0.9 < summaries['a'].durations.percentile(50) < 1.1
+    assert 9.5 < summaries['a'].durations.percentile(95) < 10.5
+    assert summaries[None].runs == 1
+
+
+@with_setup(make_tmpdir, remove_tmpdir)
+def test_process_taskdir_events():
+    taskdir = os.path.join(tmpdir, 'tasks.d')
+    make_taskdir(taskdir, [('0-ok.sh', 0), ('1-fail.sh', 4), ('2-never.sh', 0)])
+
+    config = Config()
+    config.max_tries = 2
+    config.sleep_time = 0
+    config.retry_jitter = 0
+    config.event_log = os.path.join(tmpdir, 'events.log')
+    assert runner.process_taskdir(config, taskdir) is False
+
+    events = list(read_events([config.event_log]))
+    assert [(e['task'], e.get('try_num'), e.get('attempt'), e['result'], e['exit_code']) for e in events] == [
+        ('0-ok.sh', 1, 1, 'OK', 0),
+        ('1-fail.sh', 1, 1, 'RETRY', 4),
+        ('1-fail.sh', 2, 2, 'RETRY', 4),
+        ('halt.sh', None, None, 'OK', 0),
+    ]
+    assert summarize_events(events)['0-ok.sh'].retries == 0
+    assert summarize_events(events)['1-fail.sh'].retries == 1
+    # and the event log can be replayed by the simulator
+    traces = load_traces(open(config.event_log))
+    assert sorted(traces) == ['0-ok.sh', '1-fail.sh', 'halt.sh']
@@ -8,9 +8,20 @@ from runner.lib.config import TaskConfig
 from runner.lib.graph import (
     TaskGraph,
     DependencyDoesNotExistError,
+    TaskDoesNotExistError,
     CycleError
 )
 
+multi_deps = [('cleanup', ['update_shared_repos']),
+              ('clobber', ['checkout_tools']), ('check_ami', []),
+              ('check_slavealloc', []),
+              ('killprocs', ['update_shared_repos']),
+              ('checkout_tools', ['check_ami', 'check_slavealloc']),
+              ('purge_builds', ['clobber']),
+              ('update_shared_repos', ['purge_builds']),
+              ('buildbot', ['cleanup', 'killprocs']),
+              ('done', ['buildbot'])]
+
 
 def test_graph_ok_no_deps():
     ok = [('a', []), ('z', []), ('y', []), ('0', []), ('9', [])]
@@ -65,3 +76,42 @@ def test_graph_cycle():
              ('oranges', ['apples', 'bees']), ('birds', ['oranges'])]
     graph = TaskGraph(map(TaskConfig.fromtuple, cycle))
     graph.sequential_ordering()
+
+
+def test_graph_ancestors():
+    graph = TaskGraph(map(TaskConfig.fromtuple, multi_deps))
+    assert graph.ancestors('check_ami') == set()
+    assert graph.ancestors('purge_builds') == set(['clobber', 'checkout_tools', 'check_ami',
+                                                   'check_slavealloc'])
+
+
+def test_graph_descendants():
+    graph = TaskGraph(map(TaskConfig.fromtuple, multi_deps))
+    assert graph.descendants('done') == set()
+    assert graph.descendants('killprocs') == set(['buildbot', 'done'])
+    assert graph.descendants('check_ami') == graph.descendants('check_slavealloc')
+
+
+def test_graph_levels():
+    graph = TaskGraph(map(TaskConfig.fromtuple, multi_deps))
+    assert graph.levels() == [['check_ami', 'check_slavealloc'],
+                              ['checkout_tools'],
+                              ['clobber'],
+                              ['purge_builds'],
+                              ['update_shared_repos'],
+                              ['cleanup', 'killprocs'],
+                              ['buildbot'],
+                              ['done']]
+
+
+@nose.tools.raises(TaskDoesNotExistError)
+def test_graph_descendants_missing():
+    graph = TaskGraph(map(TaskConfig.fromtuple, multi_deps))
+    graph.descendants('birds')
+
+
+@nose.tools.raises(CycleError)
+def test_graph_levels_cycle():
+    cycle = [('apples', []), ('oranges', ['apples', 'birds']), ('birds', ['oranges'])]
+    graph = TaskGraph(map(TaskConfig.fromtuple, cycle))
+    graph.levels()
@@ -3,6 +3,11 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import os
+import sys
+import time
+import signal
+import threading
+import shutil
 import tempfile
 import json
 
@@ -11,6 +16,11 @@ from nose import with_setup
 import runner
 
 from runner.lib.config import Config
+from runner.lib.events import read_events
+from runner.lib.triggers import make_triggers
+from runner.lib.utils import sleep
+
+from helpers import make_script, make_taskdir
 
 tasksd = os.path.join(os.path.split(__file__)[0], 'test-tasks.d')
 logfile = tempfile.mktemp()  # this is only a unique name, no file is created
@@ -43,6 +53,158 @@ def test_task_exit_codes():
     assert runner.run_task(retry_t, env, 1) == "RETRY"
 
 
+def test_output_triggers():
+    env = {}
+    bash_cmd = ['/usr/bin/env', 'bash', '-c']
+    triggers = make_triggers(dict(success_pattern='^ready', fail_pattern='disconnected',
+                                  halt_pattern='shut ?down'))
+
+    # matches are acted on without waiting for the task to finish
+    start = time.time()
+    ready_t = bash_cmd + ['echo starting; echo ready; sleep 10']
+    assert runner.run_task(ready_t, env, 20, triggers=triggers) == "OK"
+    assert time.time() - start < 5
+
+    # a match takes priority over the exit code
+    fail_t = bash_cmd + ['echo lost: disconnected; exit 0']
+    assert runner.run_task(fail_t, env, 5, triggers=triggers) == "RETRY"
+    halt_t = bash_cmd + ['echo ready to shut down >&2; exit 1']
+    assert runner.run_task(halt_t, env, 5, triggers=triggers) == "HALT"
+
+    # without a match the exit code is used
+    exit_t = bash_cmd + ['echo not ready; exit 3']
+    assert runner.run_task(exit_t, env, 5, triggers=triggers) == "EXIT"
+
+
+def test_output_triggers_python_task():
+    # Python buffers output to a pipe, which would hold back the match until
+    # the task exits
+    triggers = make_triggers(dict(success_pattern='^ready'))
+    start = time.time()
+    ready_t = [sys.executable, '-c', 'import time; print "ready"; time.sleep(10)']
+    assert runner.run_task(ready_t, {}, 20, triggers=triggers) == "OK"
+    assert time.time() - start < 5
+
+
+def test_make_triggers():
+    assert make_triggers({}) is None
+    assert make_triggers(dict(success_pattern='(unbalanced')) is None
+    triggers = make_triggers(dict(success_pattern='a', halt_pattern='b'))
+    assert [(regex.pattern, result) for regex, result in triggers] == [('b', 'HALT'), ('a', 'OK')]
+
+
+def test_held_task():
+    env = {}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        marker = os.path.join(tmpdir, 'ran')
+        touch_t = ['/usr/bin/env', 'bash', '-c', 'touch %s' % marker]
+
+        proc, watcher = runner.spawn_task(touch_t, env, hold=True)
+        time.sleep(0.5)
+        assert not os.path.exists(marker)
+        runner.release_task(proc)
+        assert runner.wait_task(proc, watcher, time.time(), 5) == "OK"
+        assert os.path.exists(marker)
+
+        os.remove(marker)
+        proc, watcher = runner.spawn_task(touch_t, env, hold=True)
+        runner.abort_task(proc)
+        assert not os.path.exists(marker)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_pipelined_tasks():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        taskdir = os.path.join(tmpdir, 'tasks.d')
+        tasklog = os.path.join(tmpdir, 'log')
+        make_taskdir(taskdir, [('0-a.sh', 0), ('1-b.sh', 0), ('2-c.sh', 0)], tasklog)
+        config = Config()
+        config.pipeline = True
+        assert runner.process_taskdir(config, taskdir) is True
+        assert open(tasklog).read().split() == ['0-a.sh', '1-b.sh', '2-c.sh']
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_pipelined_tasks_failure():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        taskdir = os.path.join(tmpdir, 'tasks.d')
+        tasklog = os.path.join(tmpdir, 'log')
+        make_taskdir(taskdir, [('0-a.sh', 0), ('1-b.sh', 2), ('2-c.sh', 0)], tasklog)
+        config = Config()
+        config.pipeline = True
+        assert runner.process_taskdir(config, taskdir) is False
+        # 2-c.sh was held ready, but never ran
+        assert open(tasklog).read().split() == ['0-a.sh', '1-b.sh', 'halt.sh']
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_task_selection():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        taskdir = os.path.join(tmpdir, 'tasks.d')
+        make_taskdir(taskdir, [('0-a.sh', 0), ('1-b.sh', 0), ('2-c.sh', 0), ('3-d.sh', 0)])
+        config_file = os.path.join(tmpdir, 'runner.cfg')
+        with open(config_file, 'w') as f:
+            f.write('[b]\ndepends_on = 0-a.sh\n[c]\ndepends_on = 1-b.sh\n')
+        config = Config()
+        config.load_config(config_file)
+
+        assert runner.get_task_list(config, taskdir) == ['0-a.sh', '1-b.sh', '2-c.sh', '3-d.sh']
+        assert runner.get_task_list(config, taskdir, only=['b']) == ['1-b.sh']
+        assert runner.get_task_list(config, taskdir, only=['b', '3-d.sh']) == ['1-b.sh', '3-d.sh']
+        assert runner.get_task_list(config, taskdir, only=['b'], with_deps=True) == ['0-a.sh', '1-b.sh']
+        # d comes after b, but doesn't depend on it
+        assert runner.get_task_list(config, taskdir, from_task='b') == ['1-b.sh', '2-c.sh']
+        assert runner.get_task_list(config, taskdir, from_task='b', with_deps=True) == \
+            ['0-a.sh', '1-b.sh', '2-c.sh']
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_pipelined_tasks_slow_hook():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        taskdir = os.path.join(tmpdir, 'tasks.d')
+        tasklog = os.path.join(tmpdir, 'log')
+        make_taskdir(taskdir, [('0-a.sh', 0), ('1-b.sh', 0), ('2-c.sh', 0)], tasklog)
+        hook = os.path.join(tmpdir, 'hook.sh')
+        make_script(hook, "#!/bin/sh\nsleep 1\n")
+
+        config = Config()
+        config.pipeline = True
+        config.task_hook = hook
+        config.event_log = os.path.join(tmpdir, 'events.log')
+        assert runner.process_taskdir(config, taskdir) is True
+        assert open(tasklog).read().split() == ['0-a.sh', '1-b.sh', '2-c.sh']
+
+        # the next task's pre-task hook runs alongside each task, but isn't
+        # counted as part of it
+        events = list(read_events([config.event_log]))
+        assert [e['task'] for e in events] == ['0-a.sh', '1-b.sh', '2-c.sh']
+        for e in events:
+            assert e['duration'] < 0.5, e
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_sleep_through_signals():
+    # e.g. a SIGHUP asking for a reload mustn't cut short a retry's sleep
+    old_handler = signal.signal(signal.SIGHUP, lambda signum, frame: None)
+    try:
+        threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGHUP)).start()
+        start = time.time()
+        sleep(1)
+        assert time.time() - start >= 1
+    finally:
+        signal.signal(signal.SIGHUP, old_handler)
+
+
 original_run_task = None
 fake_run_task_return_values = {
     os.path.join(tasksd, '1-say-bar.py'): 'RETRY',
@@ -57,9 +219,9 @@ def fake_run_task(*args, **kwargs):
 
 
 def replace_run_task_with_fake():
-    global fake_run_task_arguments
+    global fake_run_task_arguments, original_run_task
     fake_run_task_arguments = []
-    original_run_task = runner.run_task  # noqa
+    original_run_task = runner.run_task
     runner.run_task = fake_run_task
 
 
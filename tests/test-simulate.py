@@ -0,0 +1,83 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import json
+import random
+
+import runner
+
+from runner.lib.config import Config
+from runner.lib.simulate import Simulator, load_traces
+
+tasksd = os.path.join(os.path.split(__file__)[0], 'test-tasks.d')
+
+
+def make_traces(*records):
+    return load_traces(json.dumps(r) for r in records)
+
+
+def make_config(**kwargs):
+    config = Config()
+    config.sleep_time = 0
+    config.retry_jitter = 0
+    for k, v in kwargs.items():
+        setattr(config, k, v)
+    return config
+
+
+def test_load_traces():
+    traces = load_traces([
+        json.dumps(dict(task='a', try_num=1, result='RUNNING')),
+        json.dumps(dict(task='a', try_num=1, result='RETRY', duration=2.5)),
+        '',
+        'not json',
+        json.dumps(dict(task='a', try_num=2, result='OK', duration=1)),
+        # e.g. the halt task, which isn't run as part of a try
+        json.dumps(dict(task='halt.sh', result='OK', duration=3)),
+    ])
+    assert traces == {'a': {None: [(2.5, 'RETRY'), (1.0, 'OK')],
+                            1: [(2.5, 'RETRY')],
+                            2: [(1.0, 'OK')]},
+                      'halt.sh': {None: [(3.0, 'OK')]}}
+
+
+def test_simulate_all_ok():
+    traces = make_traces(dict(task='a', try_num=1, result='OK', duration=3),
+                         dict(task='b', try_num=1, result='OK', duration=4))
+    simulator = Simulator(make_config(), ['a', 'b'], traces, random.Random(0))
+    assert simulator.run_iteration() == (7.0, 'OK')
+
+
+def test_simulate_retry_then_ok():
+    # 'b' fails on the first try, so 'a' runs once and 'b' twice
+    traces = make_traces(dict(task='a', try_num=1, result='OK', duration=3),
+                         dict(task='b', try_num=1, result='RETRY', duration=4),
+                         dict(task='b', try_num=2, result='OK', duration=5))
+    simulator = Simulator(make_config(), ['a', 'b'], traces, random.Random(0))
+    assert simulator.run_iteration() == (12.0, 'OK')
+
+
+def test_simulate_max_tries_halts():
+    traces = make_traces(dict(task='a', try_num=1, result='RETRY', duration=1),
+                         dict(task='halt.sh', result='OK', duration=10))
+    simulator = Simulator(make_config(max_tries=3), ['a'], traces, random.Random(0))
+    assert simulator.run_iteration() == (13.0, 'HALT')
+
+
+def test_simulate_max_time_kills():
+    traces = make_traces(dict(task='a', try_num=1, result='OK', duration=100))
+    simulator = Simulator(make_config(max_tries=2, max_time=30), ['a'], traces, random.Random(0))
+    assert simulator.run_iteration() == (60.0, 'HALT')
+
+
+def test_simulate_summary():
+    traces = make_traces(dict(task='0-say-foo.py', try_num=1, result='OK', duration=1),
+                         dict(task='1-say-bar.py', try_num=1, result='EXIT', duration=2))
+    config = make_config()
+    simulator = Simulator(config, runner.get_task_list(config, tasksd), traces, random.Random(0))
+    summary = simulator.run(100)
+    assert summary['iterations'] == 100
+    assert summary['outcomes']['EXIT'] == 100
+    assert summary['p50'] == summary['p95'] == summary['max'] == 3.0